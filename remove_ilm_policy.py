@@ -1,136 +1,279 @@
 #!/usr/bin/env python3
 import os
 import re
-import json
+import time
+import base64
+import logging
 import argparse
-import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import lru_cache
 from datetime import datetime
 from getpass import getpass
 from pathlib import Path
-from dotenv import load_dotenv
+import ijson
+import orjson
+import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
 
-# ------------------------------------------------
-# Load environment variables
-# ------------------------------------------------
 env_path = Path(__file__).parent / '.env'
-load_dotenv(dotenv_path=env_path)
 
 # Configuration
-OLD_FORMAT_PATTERN = re.compile(r".*_c\d{3}_.*")
+OLD_FORMAT_PATTERN = re.compile(r"_c\d{3}_")  # used with .search()
 DRY_RUN_FILE = "ilm_template_removal_plan.txt"
 LIFECYCLE_LIST_FILE = "templates_with_lifecycle.txt"
+MAX_WORKERS = 16  # stay well under ES's default HTTP handler limits
+BODY_MAX_AGE = 5  # seconds a prefetched body may wait before it is re-read for the PUT
+# Server-side projection of the listing: only what the scan needs, not mappings/aliases
+TEMPLATE_FILTER_PATH = ",".join([
+    "index_templates.name",
+    "index_templates.index_template.index_patterns",
+    "index_templates.index_template.template.settings.index.lifecycle",
+])
+
+# Connection settings resolved from CLI args, then the environment / .env
+ENV_ARGS = (('host', 'ES_HOST'), ('port', 'ES_PORT'), ('user', 'ES_USER'), ('password', 'ES_PASSWORD'))
+DEFAULT_HOST = 'localhost'
+DEFAULT_PORT = 9200
+
+# ------------------------------------------------
+# Load environment variables (only when needed)
+# ------------------------------------------------
+def _load_env():
+    """Read .env lazily; skipped entirely when the CLI already supplies every setting."""
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path=env_path)
 
-# Environment defaults
-ES_HOST = os.getenv('ES_HOST', 'localhost')
-ES_PORT = int(os.getenv('ES_PORT', '9200'))
-ES_USER = os.getenv('ES_USER', None)
-ES_PASSWORD = os.getenv('ES_PASSWORD', None)
-REPORT_DETAILS = os.getenv('REPORT_DETAILS', 'false').lower() in ('1','true','yes')
+# ------------------------------------------------
+# Shared HTTP session (keep-alive + connection pooling)
+# ------------------------------------------------
+SESSION = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=32, pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+)
+SESSION.mount("http://", _adapter)
+SESSION.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+
+# Sent via auth= rather than headers=: without auth=, requests overwrites the header from ~/.netrc
+class PrecomputedBasicAuth(requests.auth.AuthBase):
+    """Attach a Basic auth header built once instead of re-encoding it on every request."""
+    def __init__(self, user, password):
+        token = base64.b64encode(f"{user}:{password or ''}".encode()).decode()
+        self.header = f"Basic {token}"
+
+    def __call__(self, r):
+        r.headers["Authorization"] = self.header
+        return r
+
+@lru_cache(maxsize=None)
+def session_auth(user, password):
+    """Return the shared auth object for a credential pair, or None without a user."""
+    return PrecomputedBasicAuth(user, password) if user else None
 
 def curl_request(host, port, user, password, method, path, data=None, timeout=10):
     url = f"http://{host}:{port}{path}"
-    cmd = ["curl", "-s", "--max-time", str(timeout), "-u", f"{user}:{password}",
-           "-H", "Content-Type: application/json", "-H", "Accept: application/json", "-X", method]
-    if data is not None:
-        cmd += ["-d", json.dumps(data)]
-    cmd.append(url)
+    auth = session_auth(user, password)
 
     try:
-        print(f"[DEBUG] Running curl: {' '.join(cmd)}")  # Optional: Log the curl command
-        out = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
-        return json.loads(out)
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode().strip()
-        msg = error_output or f"Connection to {url} failed."
-        print(f"[ERROR] curl failed on {path} (exit code {e.returncode}):\n{msg}")
-    except json.JSONDecodeError:
+        logger.debug("%s %s", method, url)
+        if data is not None and not isinstance(data, bytes):
+            data = orjson.dumps(data)
+        resp = SESSION.request(method, url, data=data, auth=auth, timeout=timeout)
+        resp.raise_for_status()
+        return orjson.loads(resp.content)
+    except requests.HTTPError as e:
+        msg = e.response.text.strip() or f"HTTP {e.response.status_code}"
+        print(f"[ERROR] {method} {path} failed (HTTP {e.response.status_code}):\n{msg}")
+    except requests.RequestException as e:
+        print(f"[ERROR] Connection to {url} failed: {e}")
+    except ValueError:
         print(f"[ERROR] Cannot parse JSON response from {path}")
     except Exception as ex:
         print(f"[ERROR] Unexpected error in curl_request: {ex}")
     return None
 
-def template_has_lifecycle(host, port, user, password, name):
-    """Return True if the composable template has ILM settings."""
-    path = f"/_index_template/{name}"
-    resp = curl_request(host, port, user, password, "GET", path)
-    if not resp or 'index_templates' not in resp:
+class TemplateListingError(Exception):
+    """The /_index_template listing failed; any entries already yielded are incomplete."""
+
+def iter_index_templates(host, port, user, password, timeout=10, fast_reject=None):
+    """Yield projected composable templates, skipping decoding when `fast_reject` bytes are absent."""
+    url = f"http://{host}:{port}/_index_template?filter_path={TEMPLATE_FILTER_PATH}"
+    auth = session_auth(user, password)
+    try:
+        logger.debug("GET %s (streaming)", url)
+        with SESSION.get(url, auth=auth, timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            if fast_reject is not None:
+                content = r.content  # already decompressed by requests
+                if fast_reject not in content:
+                    return
+                # Already fully buffered, so one orjson call beats incremental parsing
+                yield from orjson.loads(content).get('index_templates', [])
+                return
+            r.raw.decode_content = True  # let urllib3 undo any gzip/deflate encoding
+            yield from ijson.items(r.raw, 'index_templates.item')
+    except requests.HTTPError as e:
+        print(f"[ERROR] GET /_index_template failed (HTTP {e.response.status_code})")
+        raise TemplateListingError(url) from e
+    except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+        # ijson reads r.raw directly, so mid-body errors surface as raw urllib3 exceptions
+        print(f"[ERROR] Connection to {url} failed: {e}")
+        raise TemplateListingError(url) from e
+    except (ijson.JSONError, orjson.JSONDecodeError) as e:
+        print("[ERROR] Cannot parse JSON response from /_index_template")
+        raise TemplateListingError(url) from e
+
+def _has_lifecycle(tmpl):
+    """Return True if a template body sets template.settings.index.lifecycle."""
+    try:
+        return 'lifecycle' in tmpl['template']['settings']['index']
+    except (KeyError, TypeError):
         return False
-    tmpl = resp['index_templates'][0]['index_template']
-    settings = tmpl.get('template', {}).get('settings', {})
-    return 'lifecycle' in settings.get('index', {})
+
+def fetch_template_body(host, port, user, password, name):
+    """GET the full body of one composable template (the bulk listing is projected)."""
+    resp = curl_request(host, port, user, password, "GET", f"/_index_template/{name}")
+    if not resp or not resp.get('index_templates'):
+        return None
+    return resp['index_templates'][0]['index_template']
+
+@dataclass(slots=True)
+class TemplateRef:
+    """A template matched by the scan; `body` holds the full definition once fetched."""
+    name: str
+    kind: str  # 'composable' | 'legacy'
+    has_lifecycle: bool
+    body: dict | None = None
 
 def scan_templates(host, port, user, password):
-    """Fetch composable templates, filter by OLD_FORMAT_PATTERN and ILM presence."""
+    """Fetch composable templates, filter by OLD_FORMAT_PATTERN and ILM presence.
+
+    Returns None if the listing could not be fetched completely.
+    """
     candidates = []
     skipped = []
-    comp = curl_request(host, port, user, password, "GET", "/_index_template")
-    if comp and 'index_templates' in comp:
-        for entry in comp['index_templates']:
+    match = OLD_FORMAT_PATTERN.search
+    try:
+        # Every OLD_FORMAT_PATTERN hit contains the literal '_c'; skip decoding if the raw body lacks it
+        for entry in iter_index_templates(host, port, user, password, fast_reject=b'_c'):
             name = entry['name']
             # Skip templates containing 'query' or 'user'
             # if 'query' in name or 'user' in name:
             #     skipped.append(name)
             #     continue# skip legacy filtering here; only OLD_FORMAT_PATTERN applies
-            patterns = entry['index_template'].get('index_patterns', [])
-            if any(OLD_FORMAT_PATTERN.match(p) for p in patterns):
-                if template_has_lifecycle(host, port, user, password, name):
-                    candidates.append(name)
-                else:
-                    skipped.append(name)
+            tmpl = entry['index_template']
+            patterns = tmpl.get('index_patterns', [])
+            # One search over the NUL-joined list; NUL can't appear in a pattern or bridge a match
+            if match('\x00'.join(patterns)):
+                # The bulk listing already carries settings; no per-name GET needed
+                ref = TemplateRef(name, 'composable', _has_lifecycle(tmpl))
+                (candidates if ref.has_lifecycle else skipped).append(ref)
+    except TemplateListingError:
+        return None
     return candidates, skipped
 
-def remove_lifecycle_from_template(host, port, user, password, name):
-    """GET composable template, strip ILM settings, PUT back."""
-    path = f"/_index_template/{name}"
-    resp = curl_request(host, port, user, password, "GET", path)
-    tmpl = resp['index_templates'][0]['index_template']
-    tmpl.get('template', {}).get('settings', {}).get('index', {}).pop('lifecycle', None)
-    return 'PUT', path, tmpl
+def remove_lifecycle_from_template(name, tmpl_body):
+    """Strip ILM settings from an already-fetched composable template body for PUT back.
+
+    The body is serialized once here; callers send or print the returned bytes as-is.
+    """
+    try:
+        del tmpl_body['template']['settings']['index']['lifecycle']
+    except (KeyError, TypeError):
+        pass
+    return 'PUT', f"/_index_template/{name}", orjson.dumps(tmpl_body)
 
-def generate_dry_run_plan(templates, host, port):
+def generate_dry_run_plan(templates, host, port, user, password):
     if not templates:
         print("No matching templates with ILM found. No plan created.")
         return
+    # The listing is projected, so fetch full bodies for the K candidates concurrently
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        bodies = ex.map(lambda t: fetch_template_body(host, port, user, password, t.name), templates)
+        for t, body in zip(templates, bodies):
+            t.body = body
     print(f"\nWriting dry-run plan to {DRY_RUN_FILE}…")
-    with open(DRY_RUN_FILE, 'w') as f:
-        f.write(f"# Plan generated on: {datetime.now().isoformat()}\n")
-        f.write(f"# ES host: {host}:{port}\n# Commands: GET then PUT without ILM settings\n\n")
-        for name in templates:
-            f.write(f"# GET /_index_template/{name}\n")
-            f.write(f"curl -s -u {ES_USER}:<password> -H 'Accept: application/json' \\\n")
-            f.write(f"    http://{host}:{port}/_index_template/{name}\n\n")
-            method, path, data = remove_lifecycle_from_template(host, port, ES_USER, ES_PASSWORD, name)
-            body = json.dumps(data)
-            f.write(f"# PUT {path}\n")
-            f.write(f"curl -X PUT -u {ES_USER}:<password> -H 'Content-Type: application/json' \\\n")
-            f.write(f"    http://{host}:{port}{path} -d '{body}'\n\n")
+    # Assemble the whole plan in memory and hand it to the file in a single write
+    parts = [
+        f"# Plan generated on: {datetime.now().isoformat()}\n",
+        f"# ES host: {host}:{port}\n# Commands: GET then PUT without ILM settings\n\n",
+    ]
+    for t in templates:
+        parts.append(f"# GET /_index_template/{t.name}\n")
+        parts.append(f"curl -s -u {user}:<password> -H 'Accept: application/json' \\\n")
+        parts.append(f"    http://{host}:{port}/_index_template/{t.name}\n\n")
+        if t.body is None:
+            parts.append(f"# SKIP {t.name}: could not fetch template body\n\n")
+            continue
+        method, path, body_bytes = remove_lifecycle_from_template(t.name, t.body)
+        body = body_bytes.decode()
+        parts.append(f"# PUT {path}\n")
+        parts.append(f"curl -X PUT -u {user}:<password> -H 'Content-Type: application/json' \\\n")
+        parts.append(f"    http://{host}:{port}{path} -d '{body}'\n\n")
+    with open(DRY_RUN_FILE, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.write(''.join(parts))
     print("✅ Dry-run plan written.")
 
-def execute_removal(templates, host, port):
+def fetch_template_body_stamped(host, port, user, password, name):
+    """Return (body, monotonic time it was read) for one composable template."""
+    body = fetch_template_body(host, port, user, password, name)
+    return body, time.monotonic()
+
+def put_without_lifecycle(host, port, user, password, ref, fetched_at):
+    """Strip ILM from ref.body and PUT it back, re-reading the template first if the body is stale."""
+    # A body prefetched before a slow confirmation could revert edits made in the meantime
+    if ref.body is None or time.monotonic() - fetched_at > BODY_MAX_AGE:
+        ref.body = fetch_template_body(host, port, user, password, ref.name)
+        if ref.body is None:
+            return None
+    method, path, body_bytes = remove_lifecycle_from_template(ref.name, ref.body)
+    return curl_request(host, port, user, password, method, path, body_bytes)
+
+def execute_removal(templates, host, port, user, password):
     if not templates:
         print("No matching templates with ILM to update.")
         return
     print("\n--- EXECUTE MODE ---")
-    if input("Type 'proceed' to remove ILM from these templates: ").strip().lower() != 'proceed':
-        print("Aborted.")
-        return
-    for name in templates:
-        method, path, data = remove_lifecycle_from_template(host, port, ES_USER, ES_PASSWORD, name)
-        print(f"Updating template '{name}'…", end=' ')
-        resp = curl_request(host, port, ES_USER, ES_PASSWORD, method, path, data)
-        print("OK" if resp else "FAIL")
+    # Updates are independent, so overlap their round trips on a bounded pool
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        # Start fetching full bodies now so the GETs overlap with the confirmation prompt
+        body_futs = {
+            ex.submit(fetch_template_body_stamped, host, port, user, password, t.name): t
+            for t in templates
+        }
+        try:
+            confirm = input("Type 'proceed' to remove ILM from these templates: ").strip().lower()
+        except BaseException:
+            # Ctrl-C / EOF: don't let the executor drain the queued GETs before exiting
+            ex.shutdown(wait=False, cancel_futures=True)
+            raise
+        if confirm != 'proceed':
+            ex.shutdown(wait=False, cancel_futures=True)
+            print("Aborted.")
+            return
+        put_futs = {}
+        for fut in as_completed(body_futs):
+            t = body_futs[fut]
+            t.body, fetched_at = fut.result()
+            put_futs[ex.submit(put_without_lifecycle, host, port, user, password,
+                               t, fetched_at)] = t
+        for fut in as_completed(put_futs):
+            print(f"Updating template '{put_futs[fut].name}'… {'OK' if fut.result() else 'FAIL'}")
 
 def list_templates_with_lifecycle(host, port, user, password, out_file):
     """Scan all composable templates and write those with ILM to out_file."""
-    comp = curl_request(host, port, user, password, "GET", "/_index_template")
-    if not comp or 'index_templates' not in comp:
+    # The listing already carries settings.index.lifecycle, so no per-name GET
+    try:
+        names = [entry['name'] for entry in iter_index_templates(host, port, user, password)
+                 if _has_lifecycle(entry['index_template'])]
+    except TemplateListingError:
         print("Failed to fetch index templates.")
         return
-    names = []
-    for entry in comp['index_templates']:
-        name = entry['name']
-        if template_has_lifecycle(host, port, user, password, name):
-            names.append(name)
 
     with open(out_file, 'w') as f:
         for n in names:
@@ -141,17 +284,27 @@ def main():
     parser = argparse.ArgumentParser(
         description="Manage ILM on composable index templates"
     )
-    parser.add_argument('--host',     default=ES_HOST)
-    parser.add_argument('--port',     type=int, default=ES_PORT)
-    parser.add_argument('--user',     default=ES_USER)
-    parser.add_argument('--password', default=ES_PASSWORD)
+    parser.add_argument('--host')
+    parser.add_argument('--port',     type=int)
+    parser.add_argument('--user')
+    parser.add_argument('--password')
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--dry-run',        action='store_true', default=True)
     group.add_argument('--execute',        action='store_true')
     group.add_argument('--list-lifecycle', action='store_true',
                        help="List all composable templates that still have an ILM policy")
+    parser.add_argument('--debug', action='store_true',
+                        help="Log every Elasticsearch request")
 
     args = parser.parse_args()
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG, format="[%(levelname)s] %(message)s")
+    if any(getattr(args, attr) is None and os.getenv(var) is None for attr, var in ENV_ARGS):
+        _load_env()
+    args.host = args.host or os.getenv('ES_HOST', DEFAULT_HOST)
+    args.port = args.port or int(os.getenv('ES_PORT', DEFAULT_PORT))
+    args.user = args.user or os.getenv('ES_USER')
+    args.password = args.password or os.getenv('ES_PASSWORD')
     if args.user and not args.password:
         args.password = getpass(f"Password for '{args.user}': ")
 
@@ -163,16 +316,20 @@ def main():
         return
 
     # existing flow: pattern-based dry-run or execute
-    templates, skipped = scan_templates(args.host, args.port, args.user, args.password)
+    result = scan_templates(args.host, args.port, args.user, args.password)
+    if result is None:
+        print("Failed to fetch index templates.")
+        return
+    templates, skipped = result
     report = f"\n[REPORT] Will update {len(templates)} templates; skipped {len(skipped)} without ILM\n"
     print(report)
     with open('report_details.txt','w') as rf:
         rf.write(report)
 
     if args.execute:
-        execute_removal(templates, args.host, args.port)
+        execute_removal(templates, args.host, args.port, args.user, args.password)
     else:
-        generate_dry_run_plan(templates, args.host, args.port)
+        generate_dry_run_plan(templates, args.host, args.port, args.user, args.password)
 
 if __name__ == '__main__':
     main()